@@ -1,20 +1,27 @@
 """Utility functions and helper classes to manage toying around with 
 ASKAP astrometry
 """
+import os
+import re
 import sys
 import logging
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from itertools import combinations
 from pathlib import Path
 from typing import NewType
 
 import astropy.units as u
-import matplotlib.pyplot as plt
 import numpy as np
-from astropy.coordinates import SkyCoord, SkyOffsetFrame, concatenate, match_coordinates_sky, search_around_sky
+from astropy.coordinates import SkyCoord, SkyOffsetFrame, concatenate, match_coordinates_sky
 from astropy.coordinates import match_coordinates_sky
 from astropy.table import Table
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+from pandas import DataFrame
+from scipy.spatial import cKDTree
 
 
 handler = logging.StreamHandler(sys.stdout)
@@ -23,8 +30,18 @@ logger = logging.getLogger("askapmetry")
 logger.setLevel(logging.INFO)
 
 Paths = tuple[Path, ...]
+CATALOGUE_COLUMNS = ("ra", "dec", "int_flux", "peak_flux")
+"""The columns of the aegean component catalogues that are used"""
 MatchMatrix = NewType("MatchMatrix", np.ndarray)
 
+_RNG = np.random.default_rng()
+"""Random number generator used when reseeding the fixed catalogue"""
+
+_FIGURE: Figure | None = None
+"""Figure reused by the plotting functions. Created on first use by ``_get_figure_and_axes``"""
+
+_BEAM_RE = re.compile(r"(?:^|\.)beam(\d+)(?:\.|$)")
+
 @dataclass
 class Offset:
     """Contains offsets in the RA and Dec directions in arcsec"""
@@ -41,12 +58,33 @@ class Catalogue:
     """The table loaded"""
     path: Path
     """Original path to the loaded catalogue"""
-    center: SkyCoord
-    """Rough beam center derived from coordinates of componetns in catalogue"""
+    center_radec: tuple[float, float]
+    """Rough beam center in degrees derived from coordinates of componetns in catalogue"""
     fixed: bool = False
     """Indicates whether beam has been fixed into a place"""
     offset: Offset = field(default_factory=Offset)
     """Per beam offsets, if known, in arcsec"""
+    ra_deg: np.ndarray | None = None
+    """RA of the components in degrees. Taken from the table if not provided"""
+    dec_deg: np.ndarray | None = None
+    """Dec of the components in degrees. Taken from the table if not provided"""
+    _sky_pos: SkyCoord | None = None
+    """Cached sky-positions of the table. Created on first use by ``make_sky_coords``"""
+    _xyz: np.ndarray | None = None
+    """Cached unit-sphere cartesian positions of the table. Created on first use by ``make_xyz_positions``"""
+    _tree: cKDTree | None = None
+    """Cached KD-tree of the unit-sphere cartesian positions. Created on first use by ``make_xyz_tree``"""
+
+    def __post_init__(self) -> None:
+        if self.ra_deg is None:
+            self.ra_deg = np.ascontiguousarray(self.table["ra"], dtype=np.float64)
+        if self.dec_deg is None:
+            self.dec_deg = np.ascontiguousarray(self.table["dec"], dtype=np.float64)
+    
+    @property
+    def center(self) -> SkyCoord:
+        """Rough beam center as a sky-coordinate"""
+        return SkyCoord(*self.center_radec, unit=(u.deg, u.deg))
     
     def __repr__(self) -> str:
         return f"Catalogue(beam={self.beam}, table={len(self.table)} sources, path={self.path}, fixed={self.fixed})"
@@ -77,6 +115,10 @@ class Match:
     """Difference in RA coordinates between matches"""
     err_dec: np.ndarray
     """Different in Dec coordinates between matches"""
+    separations: np.ndarray
+    """Angular separations between matches in arcseconds"""
+
+PairCache = dict[tuple[int, int], Match]
 
 @dataclass
 class BeamPair:
@@ -92,7 +134,7 @@ class BeamPair:
 class StepInfo:
     """Statistics around the step in the alignmnet process"""
     accumulated_seps: float
-    """The total separation amoung matched sources"""
+    """The total separation amoung matched sources, in degrees"""
     number_of_matches: int
     """The total number of matches"""
 
@@ -112,16 +154,23 @@ def calculate_matches(catalogue_1: Catalogue, catalogue_2: Catalogue, sep_limit_
     sky_pos_1 = make_sky_coords(catalogue_1)
     sky_pos_2 = make_sky_coords(catalogue_2)
 
-    matches = search_around_sky(
-        sky_pos_1, sky_pos_2, seplimit=sep_limit_arcsecond*u.arcsec
+    idx_1, idx_2, separations = match_xyz_trees(
+        catalogue_1=catalogue_1, catalogue_2=catalogue_2, sep_limit_arcsecond=sep_limit_arcsecond
     )
+    matches = (idx_1, idx_2)
     match_1 = sky_pos_1[matches[0]]
     match_2 = sky_pos_2[matches[1]]
 
-    # Extract the offsets of positions as angular offsets of the sphere
-    deltas = match_1.spherical_offsets_to(match_2)
-    err_ra = deltas[0].to(u.arcsec).value
-    err_dec = deltas[1].to(u.arcsec).value
+    # Extract the offsets of positions as angular offsets of the sphere. For
+    # arcsecond scale separations the small-angle approximation agrees with 
+    # astropy's `spherical_offsets_to`
+    ra_1, dec_1 = catalogue_1.ra_deg[idx_1], catalogue_1.dec_deg[idx_1]
+    ra_2, dec_2 = catalogue_2.ra_deg[idx_2], catalogue_2.dec_deg[idx_2]
+    
+    # Matches either side of RA=0 need to be wrapped
+    d_ra = (ra_2 - ra_1 + 180) % 360 - 180
+    err_ra = d_ra * np.cos(np.deg2rad(dec_1)) * 3600
+    err_dec = (dec_2 - dec_1) * 3600
     
     mean_ra, mean_dec = np.mean(err_ra), np.mean(err_dec)
     std_ra, std_dec = np.std(err_ra), np.std(err_dec)
@@ -136,23 +185,71 @@ def calculate_matches(catalogue_1: Catalogue, catalogue_2: Catalogue, sep_limit_
         offset_mean = (mean_ra, mean_dec),
         offset_std=(std_ra, std_dec),
         err_ra=err_ra,
-        err_dec=err_dec
+        err_dec=err_dec,
+        separations=separations
+    )
+
+def get_cached_matches(
+    catalogues: Catalogues, 
+    idx_1: int, 
+    idx_2: int, 
+    pair_cache: PairCache | None = None, 
+    sep_limit_arcsecond: float = 9
+) -> Match:
+    """Match a pair of catalogues, reusing a previous result if one is in the
+    cache. Matches are keyed and computed from the lower to the higher catalogue
+    index, so the order of ``idx_1`` and ``idx_2`` does not matter. The cache 
+    assumes a single ``sep_limit_arcsecond`` is used throughout. 
+
+    Args:
+        catalogues (Catalogues): The set of catalogues being matched
+        idx_1 (int): Index of the first catalogue
+        idx_2 (int): Index of the second catalogue
+        pair_cache (PairCache | None, optional): Previously computed matches. If None matches are always computed. Defaults to None.
+        sep_limit_arcsecond (float, optional): The separation limit for a match, in arcseconds. Defaults to 9.
+
+    Returns:
+        Match: The result of matching the lower to the higher indexed catalogue
+    """
+    key = (min(idx_1, idx_2), max(idx_1, idx_2))
+    if pair_cache is not None and key in pair_cache:
+        return pair_cache[key]
+    
+    matches = calculate_matches(
+        catalogue_1=catalogues[key[0]], 
+        catalogue_2=catalogues[key[1]], 
+        sep_limit_arcsecond=sep_limit_arcsecond
     )
+    if pair_cache is not None:
+        pair_cache[key] = matches
+    
+    return matches
 
+def invalidate_pair_cache(pair_cache: PairCache, idx: int) -> PairCache:
+    """Remove all cached matches involving a catalogue, e.g. after it has been shifted
+
+    Args:
+        pair_cache (PairCache): Previously computed matches
+        idx (int): Index of the catalogue that has changed
+
+    Returns:
+        PairCache: The same cache with the stale matches removed
+    """
+    for key in [key for key in pair_cache if idx in key]:
+        del pair_cache[key]
+    
+    return pair_cache
+
+@lru_cache(maxsize=None)
 def _extract_beam_from_name(name: str | Path) -> int:
     """Extract the beam number from the input file name"""
     name = str(name.name) if isinstance(name, Path) else name
 
-    components = name.split('.')
-    beam: int | None = None
-    for component in components:
-        if 'beam' in component:
-            beam = int(component.replace('beam',''))
-            break
-    else:
+    beam_match = _BEAM_RE.search(name)
+    if beam_match is None:
         raise ValueError(f"Beam was not found in {name}")
 
-    return beam
+    return int(beam_match.group(1))
 
 
 def load_catalogue(catalogue_path: Path) -> Catalogue:
@@ -165,47 +262,75 @@ def load_catalogue(catalogue_path: Path) -> Catalogue:
         Catalogue: Loaded catalogue
     """
     logger.info(f"Loading {catalogue_path}")
-    table = Table.read(catalogue_path)
+    table = Table.read(catalogue_path, format="fits", memmap=True)[list(CATALOGUE_COLUMNS)]
+    
+    # Plain float64 columns detach from the memmap and avoid carrying
+    # the float32 precision of the FITS columns into later arithmetic
+    for column in CATALOGUE_COLUMNS:
+        table[column] = np.asarray(table[column], dtype=np.float64)
         
     table_mask = filter_table(table=table)
     sub_table = table[table_mask]
 
-    center = estimate_skycoord_centre(
-        SkyCoord(table["ra"], table["dec"], unit=(u.deg, u.deg))
+    center_radec = _mean_radec(
+        ra=np.asarray(table["ra"], dtype=np.float64), 
+        dec=np.asarray(table["dec"], dtype=np.float64)
     )
     beam = _extract_beam_from_name(name=catalogue_path.name)
     
     return Catalogue(
-        beam=beam, table=sub_table, path=catalogue_path, center=center
+        beam=beam, table=sub_table, path=catalogue_path, center_radec=center_radec
     )
     
-def load_catalogues(catalogue_paths: Paths) -> Catalogues:
-    """Load in all of the catalgues"""    
-    return [load_catalogue(catalogue_path=catalogue_path) for catalogue_path in catalogue_paths]
+def load_catalogues(catalogue_paths: Paths, max_workers: int | None = None) -> Catalogues:
+    """Load in all of the catalgues. Each is loaded in a separate process.
+
+    Args:
+        catalogue_paths (Paths): The catalogues to load
+        max_workers (int | None, optional): The number of processes to use. If None one per catalogue up to the number of CPUs. Defaults to None.
+
+    Returns:
+        Catalogues: The loaded catalogues, in the same order as the paths
+    """
+    max_workers = max_workers if max_workers else max(1, min(len(catalogue_paths), os.cpu_count() or 1))
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load_catalogue, catalogue_paths))
+
+def _mean_radec(ra: np.ndarray, dec: np.ndarray) -> tuple[float, float]:
+    """Mean of a set of positions taken in their XYZ frame, returned as RA and Dec in degrees"""
+    ra_rad, dec_rad = np.deg2rad(ra), np.deg2rad(dec)
+    cos_dec = np.cos(dec_rad)
+
+    sum_x = np.sum(cos_dec * np.cos(ra_rad))
+    sum_y = np.sum(cos_dec * np.sin(ra_rad))
+    sum_z = np.sum(np.sin(dec_rad))
+
+    mean_ra = np.rad2deg(np.arctan2(sum_y, sum_x)) % 360
+    mean_dec = np.rad2deg(np.arctan2(sum_z, np.hypot(sum_x, sum_y)))
+
+    return float(mean_ra), float(mean_dec)
 
 def estimate_skycoord_centre(
-    sky_positions: SkyCoord, final_frame: str = "fk5"
+    ra: np.ndarray, dec: np.ndarray, final_frame: str | None = None
 ) -> SkyCoord:
     """Estimate the central position of a set of positions by taking the 
     mean of sky-coordinates in their XYZ geocentric frame. Quick approach
     not intended for accuracy. 
 
     Args:
-        sky_positions (SkyCoord): A set of sky positions to get the rough center of
-        final_frame (str, optional): The final frame to convert the mean position to. Defaults to "fk5".
+        ra (np.ndarray): The RA of the sky positions to get the rough center of, in degrees
+        dec (np.ndarray): The Dec of the sky positions to get the rough center of, in degrees
+        final_frame (str | None, optional): The final frame to convert the mean position to. If None the position is left in ICRS. Defaults to None.
 
     Returns:
         SkyCoord: The rough center position
     """
-    
-    xyz_positions = sky_positions.cartesian.xyz
-    xyz_mean_position = np.mean(xyz_positions, axis=1)
+    mean_ra, mean_dec = _mean_radec(ra=ra, dec=dec)
 
-    mean_position = SkyCoord(
-        *xyz_mean_position, representation_type="cartesian"
-    ).transform_to(final_frame)
+    mean_position = SkyCoord(mean_ra * u.deg, mean_dec * u.deg)
 
-    return mean_position
+    return mean_position.transform_to(final_frame) if final_frame else mean_position
 
 
 def filter_table(table: Table) -> np.ndarray:
@@ -213,23 +338,29 @@ def filter_table(table: Table) -> np.ndarray:
     based on their distance to neighbouring components and compactness. 
 
     Args:
-        table (Table): Aegean radio component catalogue
+        table (Table): Aegean radio component catalogue. Anything whose columns can be taken as arrays by name, e.g. a ``pandas.DataFrame``, also works. 
 
     Returns:
         np.ndarray: Boolean array of components to keep. 
     """
-    sky_coord = SkyCoord(table["ra"], table["dec"], unit=(u.deg, u.deg))
+    xyz_positions = make_xyz_positions(table=table)
+    tree = cKDTree(xyz_positions, balanced_tree=False, compact_nodes=False)
     
-    isolation_mask = sky_coord.match_to_catalog_sky(sky_coord, nthneighbor=2)[1] > (0.01 * u.deg)
+    # The nearest neighbour is the source itself, so the second is needed
+    neighbour_chords, _ = tree.query(xyz_positions, k=[2])
+    isolation_mask = neighbour_chords[:, 0] > _arcsec_to_chord(0.01 * 3600)
     
-    ratio = table["int_flux"] / table["peak_flux"]
+    # Plain arrays avoid the Column ufunc wrapping and its metadata handling
+    ratio = np.asarray(table["int_flux"]) / np.asarray(table["peak_flux"])
     ratio_mask = (0.8 < ratio) & (ratio < 1.2)
 
     return isolation_mask & ratio_mask
   
 
 def make_sky_coords(table: Table | Catalogue) -> SkyCoord:
-    """Create the sky-coordinates from a cataloguue table
+    """Create the sky-coordinates from a cataloguue table. If a
+    catalogue is provided the sky-coordinates are cached on it and
+    reused on subsequent calls.
 
     Args:
         table (Table | Catalogue): Loaded table or catalogue
@@ -237,10 +368,119 @@ def make_sky_coords(table: Table | Catalogue) -> SkyCoord:
     Returns:
         SkyCoord: Sky-positions loaded
     """
-    table = table.table if isinstance(table, Catalogue) else table
-    sky_pos = SkyCoord(table["ra"], table["dec"], unit=(u.deg, u.deg))
+    if isinstance(table, Catalogue):
+        if table._sky_pos is None:
+            table._sky_pos = SkyCoord(table.ra_deg, table.dec_deg, unit=(u.deg, u.deg))
+        return table._sky_pos
+
+    sky_pos = SkyCoord(table["ra"].value, table["dec"].value, unit=(u.deg, u.deg))
     return sky_pos
 
+def _radec_to_xyz(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """Convert RA and Dec in degrees to (N, 3) unit-sphere cartesian positions"""
+    ra_rad, dec_rad = np.deg2rad(ra), np.deg2rad(dec)
+    
+    return np.stack(
+        [np.cos(dec_rad) * np.cos(ra_rad), np.cos(dec_rad) * np.sin(ra_rad), np.sin(dec_rad)], axis=1
+    )
+
+def make_xyz_positions(table: Table | Catalogue) -> np.ndarray:
+    """Create the unit-sphere cartesian positions from a catalogue table. 
+    If a catalogue is provided the positions are cached on it and 
+    reused on subsequent calls.
+
+    Args:
+        table (Table | Catalogue): Loaded table or catalogue
+
+    Returns:
+        np.ndarray: The (N, 3) cartesian positions
+    """
+    if isinstance(table, Catalogue):
+        if table._xyz is None:
+            table._xyz = _radec_to_xyz(ra=table.ra_deg, dec=table.dec_deg)
+        return table._xyz
+
+    return _radec_to_xyz(
+        ra=np.asarray(table["ra"], dtype=np.float64), 
+        dec=np.asarray(table["dec"], dtype=np.float64)
+    )
+
+def make_xyz_tree(catalogue: Catalogue) -> cKDTree:
+    """Create the KD-tree over the unit-sphere cartesian positions of a 
+    catalogue. The tree is cached on the catalogue and reused on 
+    subsequent calls.
+
+    Args:
+        catalogue (Catalogue): Loaded catalogue
+
+    Returns:
+        cKDTree: The KD-tree of the catalogue positions
+    """
+    if catalogue._tree is None:
+        catalogue._tree = cKDTree(
+            make_xyz_positions(table=catalogue), balanced_tree=False, compact_nodes=False
+        )
+    return catalogue._tree
+
+def _arcsec_to_chord(sep_arcsecond: float | np.ndarray) -> float | np.ndarray:
+    """Convert an angular separation in arcseconds to a chord length on the unit sphere"""
+    return 2 * np.sin(np.deg2rad(sep_arcsecond / 3600) / 2)
+
+def _chord_to_arcsec(chord: float | np.ndarray) -> float | np.ndarray:
+    """Convert a chord length on the unit sphere to an angular separation in arcseconds"""
+    return np.rad2deg(2 * np.arcsin(chord / 2)) * 3600
+
+def match_xyz_trees(
+    catalogue_1: Catalogue, catalogue_2: Catalogue, sep_limit_arcsecond: float = 9
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find all pairs of sources between two catalogues within a separation
+    limit using their cached KD-trees. 
+
+    Args:
+        catalogue_1 (Catalogue): The first loaded catalogue
+        catalogue_2 (Catalogue): The second loaded catalogue
+        sep_limit_arcsecond (float, optional): The separation limit for a match, in arcseconds. Defaults to 9.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The indices into catalogue 1, the indices into catalogue 2 and the separations in arcseconds
+    """
+    distances = make_xyz_tree(catalogue_1).sparse_distance_matrix(
+        make_xyz_tree(catalogue_2), 
+        max_distance=_arcsec_to_chord(sep_limit_arcsecond), 
+        output_type="ndarray"
+    )
+    
+    return distances["i"], distances["j"], _chord_to_arcsec(distances["v"])
+
+def make_proximity_mask(catalogues: Catalogues, sep_limit_arcsecond: float = 9) -> np.ndarray:
+    """Identify the pairs of catalogues that are close enough on the sky to 
+    possibly share a match. Each catalogue is bounded by the largest distance
+    of its components from the beam center, so pairs whose centers are further 
+    apart than the sum of their bounds and the separation limit can not match. 
+
+    Args:
+        catalogues (Catalogues): The set of catalogues to consider
+        sep_limit_arcsecond (float, optional): The separation limit for a match, in arcseconds. Defaults to 9.
+
+    Returns:
+        np.ndarray: Boolean matrix that is True for pairs that could share matches
+    """
+    centers_xyz = _radec_to_xyz(
+        ra=np.array([catalogue.center_radec[0] for catalogue in catalogues]),
+        dec=np.array([catalogue.center_radec[1] for catalogue in catalogues])
+    )
+    radii = np.array(
+        [
+            np.max(np.linalg.norm(make_xyz_positions(catalogue) - center_xyz, axis=1), initial=0)
+            for catalogue, center_xyz in zip(catalogues, centers_xyz)
+        ]
+    )
+    
+    center_chords = np.sqrt(np.clip(2 - 2 * centers_xyz @ centers_xyz.T, 0, None))
+    threshold = radii[:, None] + radii[None, :] + _arcsec_to_chord(sep_limit_arcsecond)
+    
+    return center_chords <= threshold
+
 def make_catalogue_matrix(catalogues: Catalogues) -> MatchMatrix:
     """Match each catalogue to each other
 
@@ -253,23 +493,44 @@ def make_catalogue_matrix(catalogues: Catalogues) -> MatchMatrix:
     no_catas = len(catalogues)
     match_matrix = np.zeros((no_catas, no_catas))
 
-    combos = list(combinations(list(range(len(catalogues))), 2))
+    close = make_proximity_mask(catalogues=catalogues)
+    combos = [(b1, b2) for (b1, b2) in combinations(list(range(len(catalogues))), 2) if close[b1, b2]]
     
-    logger.info("Generating sky-posiitons in matrix")
-    sky_positions = [make_sky_coords(table=catalogue) for catalogue in catalogues]
+    logger.info("Generating sky-trees in matrix")
+    trees = [make_xyz_tree(catalogue=catalogue) for catalogue in catalogues]
+    chord_limit = _arcsec_to_chord(9)
 
-    for (b1, b2) in combos:
+    def _count_pair(combo: tuple[int, int]) -> int:
+        b1, b2 = combo
         logger.debug(f"Matching {b1} to {b2}")
-        sky_pos_1, sky_pos_2 = sky_positions[b1], sky_positions[b2]
-        
-        match_results = search_around_sky(
-            sky_pos_1, sky_pos_2, seplimit=9*u.arcsec
-        )
-        match_matrix[b1,b2] = len(match_results[0])
+        return trees[b1].count_neighbors(trees[b2], r=chord_limit)
+
+    # The KD-tree queries release the GIL, so threads are enough
+    with ThreadPoolExecutor() as executor:
+        counts = list(executor.map(_count_pair, combos))
+
+    for (b1, b2), count in zip(combos, counts):
+        match_matrix[b1,b2] = count
+
+    # Only the upper triangle is matched, but each beam should see all its matches
+    match_matrix += match_matrix.T
 
     logger.info(f"Have matched {len(combos)}")
     return match_matrix
 
+def _get_figure_and_axes() -> tuple[Figure, tuple[Axes, Axes]]:
+    """Get the cleared module figure with a fresh pair of side-by-side axes. 
+    The figure is created directly rather than through pyplot, so no GUI 
+    backend is set up and figures are not accumulated between plots."""
+    global _FIGURE
+    if _FIGURE is None:
+        _FIGURE = Figure(dpi=80)
+    
+    _FIGURE.clear()
+    axes = _FIGURE.subplots(1, 2)
+    
+    return _FIGURE, tuple(axes)
+
 def plot_match_matrix(matrix: MatchMatrix, output_path: None |Path = None) -> Path:
     """Plot the match matrix from the beam-wise matching
 
@@ -282,7 +543,7 @@ def plot_match_matrix(matrix: MatchMatrix, output_path: None |Path = None) -> Pa
     """
     logger.debug("Plotting match matrix")
     output_path = Path("match_matrix.png") if output_path is None else output_path
-    fig, (ax1, ax2) = plt.subplots(1,2)
+    fig, (ax1, ax2) = _get_figure_and_axes()
     
     cim = ax1.imshow(matrix)
     fig.colorbar(cim, label="N")
@@ -299,7 +560,7 @@ def plot_match_matrix(matrix: MatchMatrix, output_path: None |Path = None) -> Pa
     )
     
     fig.tight_layout()
-    fig.savefig(fname=output_path)
+    fig.savefig(fname=output_path, dpi=80, bbox_inches=None)
     logger.info(f"Have created {output_path=}")
     return output_path
 
@@ -333,11 +594,12 @@ def set_seed_catalogues(catalogues: Catalogues, match_matrix: MatchMatrix) -> Ca
     
     return catalogues
 
-def find_next_pair(catalogues: Catalogues) -> BeamPair | None:
+def find_next_pair(catalogues: Catalogues, pair_cache: PairCache | None = None) -> BeamPair | None:
     """Identify a pair of beams that will form a step in the deshifter
 
     Args:
         catalogues (Catalogues): Collection of beam cataloues to consider
+        pair_cache (PairCache | None, optional): Previously computed matches to reuse. Defaults to None.
 
     Returns:
         BeamPair | None: The pair of beam catalogues for this step. If there are no catalogues to shift None is returned.
@@ -354,23 +616,60 @@ def find_next_pair(catalogues: Catalogues) -> BeamPair | None:
     
     ideal_fixed_beam_idx = None
     ideal_shift_beam_idx = None
+    ideal_position = None
     current_best_match = None
+    close = make_proximity_mask(catalogues=catalogues)
+
+    # Components are isolated by filter_table by more than twice the separation
+    # limit, so each can match at most one other and a pair can not have more
+    # matches than the smaller catalogue. Visiting pairs from the largest bound
+    # down allows stopping once no remaining pair could beat the best. 
+    beam_pairs = [
+        (fixed_beam_idx, candidate_beam_idx) 
+        for fixed_beam_idx in fixed_beam_idxs 
+        for candidate_beam_idx in candidate_beam_idxs
+    ]
+    bounds = [
+        min(len(catalogues[fixed_beam_idx].ra_deg), len(catalogues[candidate_beam_idx].ra_deg)) 
+        for fixed_beam_idx, candidate_beam_idx in beam_pairs
+    ]
+    
+    for position in sorted(range(len(beam_pairs)), key=lambda position: -bounds[position]):
+        if current_best_match is not None and bounds[position] < current_best_match.n:
+            break
+        
+        fixed_beam_idx, candidate_beam_idx = beam_pairs[position]
+        # Far apart pairs have no matches so can not improve on the best
+        if current_best_match is not None and not close[fixed_beam_idx, candidate_beam_idx]:
+            continue
+        
+        matches = get_cached_matches(
+            catalogues=catalogues, 
+            idx_1=fixed_beam_idx, 
+            idx_2=candidate_beam_idx, 
+            pair_cache=pair_cache
+        )
+        
+        # Ties go to the earlier pair to match the order of a full scan
+        if (
+            current_best_match is None 
+            or matches.n > current_best_match.n 
+            or (matches.n == current_best_match.n and position < ideal_position)
+        ):
+            current_best_match = matches
+            ideal_fixed_beam_idx = fixed_beam_idx
+            ideal_shift_beam_idx = candidate_beam_idx
+            ideal_position = position
+            logger.debug(f"Update {ideal_fixed_beam_idx=} {ideal_shift_beam_idx=}")
+    
+    # Cached matches run from the lower to higher index, but the offsets
+    # need to be from the fixed to the shifted catalogue
+    if ideal_fixed_beam_idx > ideal_shift_beam_idx:
+        current_best_match = calculate_matches(
+            catalogue_1=catalogues[ideal_fixed_beam_idx], 
+            catalogue_2=catalogues[ideal_shift_beam_idx]
+        )
 
-    for fixed_beam_idx in fixed_beam_idxs:
-        fixed_beam_cata = catalogues[fixed_beam_idx]
-
-        for candidate_beam_idx in candidate_beam_idxs:
-            candidate_beam_cata = catalogues[candidate_beam_idx]
-            matches = calculate_matches(
-                catalogue_1=fixed_beam_cata, catalogue_2=candidate_beam_cata
-            )
-            
-            if current_best_match is None or matches.n > current_best_match.n:
-                current_best_match = matches
-                ideal_fixed_beam_idx = fixed_beam_idx
-                ideal_shift_beam_idx = candidate_beam_idx
-                logger.debug(f"Update {ideal_fixed_beam_idx=} {ideal_shift_beam_idx=}")
-                
     return BeamPair(
         fixed_beam_idx=ideal_fixed_beam_idx, 
         shift_beam_idx=ideal_shift_beam_idx, 
@@ -378,78 +677,99 @@ def find_next_pair(catalogues: Catalogues) -> BeamPair | None:
     )
 
 def _select_random_index(max_index: int) -> int:
-    from random import randint
-    return randint(a=0, b=max_index-1)
+    return int(_RNG.integers(0, max_index))
 
 def add_offset_to_coords_skyframeoffset(
-    sky_coords: SkyCoord, offset: tuple[float, float]
-) -> SkyCoord:
+    ra: np.ndarray, dec: np.ndarray, offset: tuple[float, float], exact: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
     """Add offsets to sky coordinate offsets. This attempts to 
     be consistent with the `spherical_offsets_to` astropy function
     and adds the angular offsets appropriately on the sphere.
 
     Args:
-        sky_coords (SkyCoord): The base set of coordinates to shift
-        offset (tuple[float, float]): The angular offsets from `spherical_offsets_to`
+        ra (np.ndarray): The base set of RA coordinates to shift, in degrees
+        dec (np.ndarray): The base set of Dec coordinates to shift, in degrees
+        offset (tuple[float, float]): The angular offsets from `spherical_offsets_to`, in arcseconds
+        exact (bool, optional): Shift with astropy's `spherical_offsets_by` rather than the small-angle approximation. Intended for validation. Defaults to False.
 
     Returns:
-        SkyCoord: The shifted sky positions
+        tuple[np.ndarray, np.ndarray]: The shifted RA and Dec positions, in degrees
     """
     # NOTE: Spheres are hard and confuse me. I am not particularly convinced
     # that simply subtracting/adding d(RA) and d(Dec) from sets is correct.
     # I trust the astropy more than I. This function attempts to do the 
     # reverse of the `spherical_offsets_to` method. 
-    
-    # The shift needs to be an array of same shape
-    d_ra = (np.zeros_like(sky_coords) - offset[0])*u.arcsec
-    d_dec = (np.zeros_like(sky_coords) - offset[1])*u.arcsec
-    
-    new_coords = sky_coords.spherical_offsets_by(
-        d_ra, d_dec
-    )
-    return new_coords
+    if exact:
+        sky_coords = SkyCoord(ra, dec, unit=(u.deg, u.deg))
+
+        # The shift needs to be an array of same shape
+        d_ra = (np.zeros_like(ra) - offset[0])*u.arcsec
+        d_dec = (np.zeros_like(dec) - offset[1])*u.arcsec
+        
+        new_coords = sky_coords.spherical_offsets_by(
+            d_ra, d_dec
+        )
+        return new_coords.ra.deg, new_coords.dec.deg
+
+    # For arcsecond scale offsets the small-angle approximation agrees
+    # with the astropy approach to well below the positional errors
+    new_ra = np.mod(ra - (offset[0] / 3600) / np.cos(np.deg2rad(dec)), 360)
+    new_dec = dec - offset[1] / 3600
+
+    return new_ra, new_dec
 
 def add_offset_to_catalogue(
-    catalogue: Catalogue, offset: tuple[float, float]
+    catalogue: Catalogue, offset: tuple[float, float], exact: bool = False
 ) -> Catalogue:
     """Add offsets to a catalogue and its table. 
     Args:
         catalogue (Catalogue): The catalogue object to shift
         offset (tuple[float, float]): The angular units to shift by
+        exact (bool, optional): Shift with astropy's `spherical_offsets_by`. See ``add_offset_to_coords_skyframeoffset``. Defaults to False.
 
     Returns:
         Catalogue: The shifted catalogue
     """
-    cata_table = catalogue.table.copy()
-    
-    sky_coords = make_sky_coords(table=cata_table)
-    new_coords = add_offset_to_coords_skyframeoffset(sky_coords, offset)
-    
-    cata_table["ra"] = new_coords.ra.deg
-    cata_table["dec"] = new_coords.dec.deg
-
-    # Trust no one
-    from copy import deepcopy
-    new_cata = deepcopy(catalogue)
-
-    new_cata.table = cata_table
+    new_ra, new_dec = add_offset_to_coords_skyframeoffset(
+        ra=catalogue.ra_deg,
+        dec=catalogue.dec_deg,
+        offset=offset,
+        exact=exact
+    )
     
-    # Update the offset in case many passes over
-    summed_offsets = Offset(
-        ra=offset[0] + new_cata.offset.ra,
-        dec=offset[1] + new_cata.offset.dec,
+    # Keep the table in sync with the shifted positions
+    cata_table = catalogue.table.copy()
+    cata_table["ra"] = new_ra
+    cata_table["dec"] = new_dec
+
+    # Update the offset in case many passes over. Caches are left 
+    # empty so they are rebuilt from the shifted table
+    new_cata = Catalogue(
+        beam=catalogue.beam,
+        table=cata_table,
+        path=catalogue.path,
+        center_radec=catalogue.center_radec,
+        fixed=catalogue.fixed,
+        offset=Offset(
+            ra=offset[0] + catalogue.offset.ra,
+            dec=offset[1] + catalogue.offset.dec,
+        ),
+        ra_deg=new_ra,
+        dec_deg=new_dec
     )
-    new_cata.offset = summed_offsets
 
     return new_cata
 
 
-def calculate_catalogue_jitter(catalogues: Catalogues, sep_limit_arcsecond: float=9) -> StepInfo:
+def calculate_catalogue_jitter(
+    catalogues: Catalogues, sep_limit_arcsecond: float=9, pair_cache: PairCache | None = None
+) -> StepInfo:
     """Calculate global statistics of all matches across all catalogues
 
     Args:
         catalogues (Catalogues): The set of catalogues to consider
         sep_limit_arcsecond (float, optional): The separation limit to condider, in arcseconds. Defaults to 9.
+        pair_cache (PairCache | None, optional): Previously computed matches to reuse. Only stale pairs are rematched. Defaults to None.
 
     Returns:
         StepInfo: Information of separations across all matches
@@ -460,25 +780,37 @@ def calculate_catalogue_jitter(catalogues: Catalogues, sep_limit_arcsecond: floa
     num_catalogues = len(catalogues)
     seps = 0
     no_matches = 0
-    combos = list(
-        combinations(
+    close = make_proximity_mask(catalogues=catalogues, sep_limit_arcsecond=sep_limit_arcsecond)
+    combos = [
+        (b1, b2) for (b1, b2) in combinations(
             list(range(num_catalogues)), 
             2
-        )
-    )
+        ) if close[b1, b2]
+    ]
+
+    def _pair_seps(combo: tuple[int, int]) -> tuple[float, int]:
+        b1, b2 = combo
+        if pair_cache is not None:
+            match_seps = get_cached_matches(
+                catalogues=catalogues, 
+                idx_1=b1, 
+                idx_2=b2, 
+                pair_cache=pair_cache, 
+                sep_limit_arcsecond=sep_limit_arcsecond
+            ).separations
+        else:
+            match_seps = match_xyz_trees(
+                catalogue_1=catalogues[b1], catalogue_2=catalogues[b2], sep_limit_arcsecond=sep_limit_arcsecond
+            )[2]
+        return np.sum(match_seps), len(match_seps)
 
-    for (b1, b2) in combos:
-        cata_1, cata_2 = catalogues[b1], catalogues[b2]
-        
-        sky_pos_1, sky_pos_2 = make_sky_coords(cata_1), make_sky_coords(cata_2)
-        
-        match_results = search_around_sky(
-            sky_pos_1, sky_pos_2, seplimit=sep_limit_arcsecond*u.arcsec
-        )
-        seps += np.sum(match_results[2])
-        no_matches += len(match_results[2])
+    # Each pair writes to its own key of the cache, so threads do not collide
+    with ThreadPoolExecutor() as executor:
+        for pair_sep, pair_matches in executor.map(_pair_seps, combos):
+            seps += pair_sep
+            no_matches += pair_matches
     
-    return StepInfo(accumulated_seps=seps, number_of_matches=no_matches)
+    return StepInfo(accumulated_seps=float(seps) / 3600, number_of_matches=no_matches)
 
 def round_header(step: int, stats: StepInfo) -> None:
     logger.info(f"Round {step}, {stats}")
@@ -498,10 +830,10 @@ def plot_iterative_shift_stats(step_statistics: list[StepInfo], output_path: Pat
 
     output_path = output_path if output_path else Path("stats_step_info.png")
 
-    seps = np.array([s.accumulated_seps.value for s in step_statistics])
+    seps = np.array([s.accumulated_seps for s in step_statistics])
     srcs = np.array([s.number_of_matches for s in step_statistics])
     
-    fig, (ax, ax2) = plt.subplots(1,2)
+    fig, (ax, ax2) = _get_figure_and_axes()
     
     ax.plot(seps)
     ax.axvline(36, ls="--", label="New Seed Beam")
@@ -520,7 +852,7 @@ def plot_iterative_shift_stats(step_statistics: list[StepInfo], output_path: Pat
     ax2.grid()
     
     fig.tight_layout()
-    fig.savefig(fname=output_path)
+    fig.savefig(fname=output_path, dpi=80, bbox_inches=None)
     
     return output_path
 
@@ -555,8 +887,9 @@ def perform_iterative_shifter(
     
     logger.info(f"Shifting {len(catalogues)}")
     step_statistics = []
+    pair_cache: PairCache = {}
     for step in range(len(catalogues) * passes):
-        pair_match = find_next_pair(catalogues)
+        pair_match = find_next_pair(catalogues=catalogues, pair_cache=pair_cache)
 
         # This is triggered if everything is already matched
         # should some iterative procedure be invoked 
@@ -571,9 +904,10 @@ def perform_iterative_shifter(
         new_catalogue.fixed = True
 
         catalogues[pair_match.shift_beam_idx] = new_catalogue
+        pair_cache = invalidate_pair_cache(pair_cache=pair_cache, idx=pair_match.shift_beam_idx)
         
         if gather_statistics:
-            total_seps = calculate_catalogue_jitter(catalogues=catalogues)
+            total_seps = calculate_catalogue_jitter(catalogues=catalogues, pair_cache=pair_cache)
             step_statistics.append(total_seps)
             round_header(step=step, stats=total_seps)
         else:
@@ -587,18 +921,16 @@ def perform_iterative_shifter(
 
 def save_catalogue_shift_positions(catalogues: Catalogues, output_path: Path | None = None) -> Path:
 
-    from pandas import DataFrame    
     output_path = output_path if output_path else Path("shifts.csv")
 
+    no_catas = len(catalogues)
     df = DataFrame(
-        [
-            {
-                'path': catalogue.path, 
-                'beam': catalogue.beam, 
-                'd_ra': catalogue.offset.ra, 
-                'd_dec': catalogue.offset.dec
-            } for catalogue in catalogues
-        ]
+        {
+            'path': [catalogue.path for catalogue in catalogues], 
+            'beam': np.fromiter((catalogue.beam for catalogue in catalogues), dtype=int, count=no_catas), 
+            'd_ra': np.fromiter((catalogue.offset.ra for catalogue in catalogues), dtype=float, count=no_catas), 
+            'd_dec': np.fromiter((catalogue.offset.dec for catalogue in catalogues), dtype=float, count=no_catas)
+        }
     )
     
     logger.info(f"Writing {output_path}")